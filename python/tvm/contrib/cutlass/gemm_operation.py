@@ -42,6 +42,7 @@ class GemmOperation:
         self.element_epilogue = element_epilogue
         self.epilogue_functor = epilogue_functor
         self.swizzling_functor = swizzling_functor
+        self._procedural_name = None
 
     def accumulator_type(self):
         return self.tile_description.math_instruction.element_accumulator
@@ -104,12 +105,16 @@ class GemmOperation:
 
     def procedural_name(self):
         """The full procedural name indicates architecture, extended name, tile size,
-        and layout.
+        and layout. It is built once and cached, since it is requested repeatedly
+        during enumeration and emission.
         """
+        if self._procedural_name is not None:
+            return self._procedural_name
+
         threadblock = self.tile_description.procedural_name()
         opcode_class_name = OpcodeClassNames[self.tile_description.math_instruction.opcode_class]
 
-        return substitute_template(
+        self._procedural_name = substitute_template(
             "cutlass_${opcode_class}_${extended_name}_${threadblock}_${layout}_align${alignment}",
             {
                 "opcode_class": opcode_class_name,
@@ -119,6 +124,7 @@ class GemmOperation:
                 "alignment": "%d" % self.A.alignment,
             },
         )
+        return self._procedural_name
 
     def leading_dim(self):
         """ lda, ldb, ldc, according to the leading dimension. """
@@ -19,13 +19,68 @@
 
 
 class GemmProfilerEmitter(object):
-    """Emit a C++ source for profiling CUTLASS kernels."""
+    """Emit a C++ source for profiling CUTLASS kernels.
+
+    Many kernels can be bundled into a single translation unit via emit_batch,
+    which generates one binary that dispatches on a kernel name passed as its
+    first argument. The single-kernel emit is a batch of one; its binary also
+    accepts the problem size directly without a leading kernel name.
+    """
 
     def __init__(self):
         from jinja2 import Template
 
+        self.block_template = Template(
+            """
+{{OperatorDef}}
+
+cudaError_t RunGemm_{{OperatorName}}(
+    int M,
+    int N,
+    int K,
+    {{DTypeC}} alpha,
+    const std::vector<{{DTypeA}}*> &A_pool,
+    int lda,
+    const std::vector<{{DTypeB}}*> &B_pool,
+    int ldb,
+    {{DTypeC}} beta,
+    {{DTypeC}} *C,
+    int ldc) {
+  using namespace std::chrono;
+  Operation_{{OperatorName}} gemm_operator;
+  Operation_{{OperatorName}}::Arguments args({M, N, K},
+                              {A_pool[0], lda},
+                              {B_pool[0], ldb},
+                              {C, ldc},
+                              {C, ldc},
+                              {alpha, beta});
+  cutlass::Status status = gemm_operator(args);
+  CUTLASS_CHECK(status)
+
+  high_resolution_clock::time_point t1 = high_resolution_clock::now();
+  for (int i = 0; i < 100; ++i) {
+    // Rotate the input pointers so that small problems do not stay resident
+    // in L2 across iterations and report optimistic runtimes.
+    Operation_{{OperatorName}}::Arguments iter_args({M, N, K},
+                                {A_pool[i % A_pool.size()], lda},
+                                {B_pool[i % B_pool.size()], ldb},
+                                {C, ldc},
+                                {C, ldc},
+                                {alpha, beta});
+    status = gemm_operator(iter_args);
+  }
+  cudaDeviceSynchronize();
+  high_resolution_clock::time_point t2 = high_resolution_clock::now();
+  duration<double> time_span = duration_cast<duration<double>>(t2 - t1);
+  std::cout << time_span.count() << std::endl;
+  return cudaSuccess;
+}
+"""
+        )
+
         self.template = Template(
             """
+#include <cstring>
 #include <iostream>
 #include <sstream>
 #include <vector>
@@ -54,42 +109,24 @@ class GemmProfilerEmitter(object):
     }                                                                   \\
   }
 
-template<typename DTypeA, typename DTypeB, typename DTypeC>
-cudaError_t CutlassGemmRCR(
-    int M,
-    int N,
-    int K,
-    DTypeC alpha,
-    DTypeA const *A,
-    int lda,
-    DTypeB const *B,
-    int ldb,
-    DTypeC beta,
-    DTypeC *C,
-    int ldc) {
-  using namespace std::chrono;
-  {{OperatorDef}}
-  Operation_{{OperatorName}} gemm_operator;
-  Operation_{{OperatorName}}::Arguments args({M, N, K},
-                              {A, lda},
-                              {B, ldb},
-                              {C, ldc},
-                              {C, ldc},
-                              {alpha, beta});
-  cutlass::Status status = gemm_operator(args);
-  CUTLASS_CHECK(status)
+{{KernelBlocks}}
 
-  high_resolution_clock::time_point t1 = high_resolution_clock::now();
-  for (int i = 0; i < 100; ++i) {
-    status = gemm_operator(args);
-  }
-  cudaDeviceSynchronize();
-  high_resolution_clock::time_point t2 = high_resolution_clock::now();
-  duration<double> time_span = duration_cast<duration<double>>(t2 - t1);
-  std::cout << time_span.count() << std::endl;
-  return cudaSuccess;
-}
+typedef cudaError_t (*GemmRunner)(
+    int, int, int, {{DTypeC}},
+    const std::vector<{{DTypeA}}*> &, int,
+    const std::vector<{{DTypeB}}*> &, int,
+    {{DTypeC}}, {{DTypeC}}*, int);
 
+struct KernelEntry {
+  const char *name;
+  GemmRunner runner;
+};
+
+static const KernelEntry kernel_table[] = {
+{{KernelTable}}
+};
+
+static const size_t num_kernels = sizeof(kernel_table) / sizeof(kernel_table[0]);
 
 template<typename DType>
 cudaError_t AllocateMatrix(DType **matrix, int ldm, int rows, int columns, int seed = 0) {
@@ -124,73 +161,138 @@ cudaError_t AllocateMatrix(DType **matrix, int ldm, int rows, int columns, int s
   return result;
 }
 
-template<typename DTypeA, typename DTypeB, typename DTypeC>
-cudaError_t TestCutlassGemm(int M, int N, int K, DTypeC alpha, DTypeC beta) {
+cudaError_t TestCutlassGemm(GemmRunner runner, int M, int N, int K,
+                            {{DTypeC}} alpha, {{DTypeC}} beta,
+                            size_t rotating_buffer_bytes) {
   cudaError_t result;
 
   {{LeadingDim}}
-  // size_t sizeof_C = sizeof(DTypeC) * ldc * N;
-  DTypeA *A;
-  DTypeB *B;
-  DTypeC *C_cutlass;
-  result = AllocateMatrix<DTypeA>(&A, lda, M, K, 0);
-  if (result !=  cudaSuccess) {
-    return result;
+  // size_t sizeof_C = sizeof({{DTypeC}}) * ldc * N;
+  // Allocate enough copies of the inputs to exceed rotating_buffer_bytes, so
+  // that rotating through them evicts each copy from L2 between uses.
+  size_t bytes_per_copy =
+      sizeof({{DTypeA}}) * size_t(M) * K + sizeof({{DTypeB}}) * size_t(K) * N;
+  size_t num_copies = 1;
+  if (rotating_buffer_bytes > bytes_per_copy) {
+    num_copies = (rotating_buffer_bytes + bytes_per_copy - 1) / bytes_per_copy;
   }
-  result = AllocateMatrix<DTypeB>(&B, ldb, K, N, 17);
-  if (result !=  cudaSuccess) {
-    cudaFree(A);
-    return result;
+  std::vector<{{DTypeA}}*> A_pool(num_copies);
+  std::vector<{{DTypeB}}*> B_pool(num_copies);
+  {{DTypeC}} *C_cutlass;
+  for (size_t i = 0; i < num_copies; ++i) {
+    result = AllocateMatrix<{{DTypeA}}>(&A_pool[i], lda, M, K, 0);
+    if (result != cudaSuccess) {
+      for (size_t j = 0; j < i; ++j) {
+        cudaFree(B_pool[j]);
+        cudaFree(A_pool[j]);
+      }
+      return result;
+    }
+    result = AllocateMatrix<{{DTypeB}}>(&B_pool[i], ldb, K, N, 17);
+    if (result != cudaSuccess) {
+      cudaFree(A_pool[i]);
+      for (size_t j = 0; j < i; ++j) {
+        cudaFree(B_pool[j]);
+        cudaFree(A_pool[j]);
+      }
+      return result;
+    }
   }
-  result = AllocateMatrix<DTypeC>(&C_cutlass, ldc, M, N, 101);
+  result = AllocateMatrix<{{DTypeC}}>(&C_cutlass, ldc, M, N, 101);
   if (result != cudaSuccess) {
-    cudaFree(A);
-    cudaFree(B);
+    for (size_t i = 0; i < num_copies; ++i) {
+      cudaFree(B_pool[i]);
+      cudaFree(A_pool[i]);
+    }
     return result;
   }
-  result = CutlassGemmRCR<DTypeA, DTypeB, DTypeC>(M, N, K, alpha, A, lda, B, ldb,
-                                                  beta, C_cutlass, ldc);
+  result = runner(M, N, K, alpha, A_pool, lda, B_pool, ldb, beta, C_cutlass, ldc);
   if (result != cudaSuccess) {
     std::cerr << "CUTLASS GEMM kernel failed: "
       << cudaGetErrorString(result) << std::endl;
-    cudaFree(C_cutlass);
-    cudaFree(B);
-    cudaFree(A);
-
-    return result;
   }
   cudaFree(C_cutlass);
-  cudaFree(B);
-  cudaFree(A);
-  return cudaSuccess;
+  for (size_t i = 0; i < num_copies; ++i) {
+    cudaFree(B_pool[i]);
+    cudaFree(A_pool[i]);
+  }
+  return result;
 }
 
 int main(int argc, const char *arg[]) {
+  // Usage: either "<kernel name> M N K [rotating_buffer_bytes]" or, when only
+  // one kernel was compiled in, "M N K [rotating_buffer_bytes]".
+  GemmRunner runner = nullptr;
+  int arg_base = 1;
+  if (argc > 1) {
+    for (size_t i = 0; i < num_kernels; ++i) {
+      if (std::strcmp(kernel_table[i].name, arg[1]) == 0) {
+        runner = kernel_table[i].runner;
+        arg_base = 2;
+        break;
+      }
+    }
+  }
+  if (runner == nullptr) {
+    if (num_kernels == 1) {
+      runner = kernel_table[0].runner;
+    } else {
+      std::cerr << "Usage: " << arg[0]
+                << " <kernel name> M N K [rotating_buffer_bytes]" << std::endl;
+      return -1;
+    }
+  }
   int problem[3] = { 4096, 4096, 4096 };
-  for (int i = 1; i < argc && i < 4; ++i) {
+  for (int i = arg_base; i < argc && i < arg_base + 3; ++i) {
     std::stringstream ss(arg[i]);
-    ss >> problem[i - 1];
+    ss >> problem[i - arg_base];
+  }
+  size_t rotating_buffer_bytes = 256 * 1024 * 1024;
+  if (argc > arg_base + 3) {
+    std::stringstream ss(arg[arg_base + 3]);
+    ss >> rotating_buffer_bytes;
   }
   float scalars[2] = { 1, 0 };
-  cudaError_t result = TestCutlassGemm< {{DTypeA}}, {{DTypeB}}, {{DTypeC}}>(
+  cudaError_t result = TestCutlassGemm(
+    runner,
     problem[0],     // GEMM M dimension
     problem[1],     // GEMM N dimension
     problem[2],     // GEMM K dimension
     static_cast<{{DTypeC}}>(scalars[0]),     // alpha
-    static_cast<{{DTypeC}}>(scalars[1])      // beta
+    static_cast<{{DTypeC}}>(scalars[1]),     // beta
+    rotating_buffer_bytes
   );
   return result == cudaSuccess ? 0 : -1;
 }
 """
         )
 
-    def emit(self, op_name, op_def, dtype_a, dtype_b, dtype_c, ld):
-        src = self.template.render(
-            OperatorName=op_name,
-            OperatorDef=op_def,
+    def emit_batch(self, kernels, dtype_a, dtype_b, dtype_c, ld):
+        """Emit one source profiling all of kernels, a list of (name, op_def) pairs.
+
+        The resulting binary takes the kernel to profile as its first argument,
+        so nvcc is invoked once for the whole batch instead of once per kernel.
+        """
+        blocks = "\n".join(
+            self.block_template.render(
+                OperatorName=name,
+                OperatorDef=op_def,
+                DTypeA=dtype_a,
+                DTypeB=dtype_b,
+                DTypeC=dtype_c,
+            )
+            for name, op_def in kernels
+        )
+        table = "\n".join('  {"%s", RunGemm_%s},' % (name, name) for name, _ in kernels)
+        return self.template.render(
+            KernelBlocks=blocks,
+            KernelTable=table,
             DTypeA=dtype_a,
             DTypeB=dtype_b,
             DTypeC=dtype_c,
             LeadingDim=ld,
         )
+
+    def emit(self, op_name, op_def, dtype_a, dtype_b, dtype_c, ld):
+        src = self.emit_batch([(op_name, op_def)], dtype_a, dtype_b, dtype_c, ld)
         return src
@@ -14,11 +14,16 @@
 # KIND, either express or implied.  See the License for the
 # specific language governing permissions and limitations
 # under the License.
-# pylint: disable=invalid-name
+# pylint: disable=invalid-name, import-outside-toplevel
 """GEMM kernel generator and profiler for CUTLASS."""
+import hashlib
+import json
+import multiprocessing
+import os
 import re
-from .gemm_operation import GemmOperation, EmitGemmInstance
-from .gemm_profiler import GemmProfilerEmitter
+import tempfile
+from functools import partial
+from itertools import product
 from .gen_tensor_op import ProfilerEngine, GENERATOR_FUNC_TABLE, EPILOGUE_MAP
 from .library import (
     EpilogueFunctor,
@@ -28,6 +33,32 @@ from .library import (
     LayoutType,
 )
 
+# Kernel alignment encoded in procedural names, e.g. "..._align8".
+_ALIGN_RE = re.compile(r"align([1248])\b")
+
+# Lazily initialized by _load_emitters. The emitter modules drag in large
+# template strings that are not needed when a warm cache answers every query.
+_GemmOperation = None
+_KERNEL_EMITTER = None
+_PROFILER_EMITTER = None
+
+
+def _load_emitters():
+    """Import the kernel and profiler emitters on first use.
+
+    The emitters themselves are shared singletons: they hold only the templates
+    built in their constructors and their emit methods are pure, so one
+    instance can serve every call.
+    """
+    global _GemmOperation, _KERNEL_EMITTER, _PROFILER_EMITTER
+    if _GemmOperation is None:
+        from .gemm_operation import GemmOperation, EmitGemmInstance
+        from .gemm_profiler import GemmProfilerEmitter
+
+        _GemmOperation = GemmOperation
+        _KERNEL_EMITTER = EmitGemmInstance()
+        _PROFILER_EMITTER = GemmProfilerEmitter()
+
 
 def create_gemm_operator_with_epilogue(
     op_type,
@@ -41,6 +72,7 @@ def create_gemm_operator_with_epilogue(
     Instantiate a cutlass kernel from the given configuration,
     along with the epilouge functor
     """
+    _load_emitters()
     element_a, element_b, element_c, element_epilogue = data_type
 
     A = TensorDescription(element_a, LayoutType.RowMajor, alignment)
@@ -52,7 +84,7 @@ def create_gemm_operator_with_epilogue(
 
     epilogue, no_beta_scaling = EPILOGUE_MAP[op_type]
 
-    op = GemmOperation(
+    op = _GemmOperation(
         tile_description.minimum_compute_capability,
         tile_description,
         A,
@@ -63,8 +95,129 @@ def create_gemm_operator_with_epilogue(
         swizzling_functor,
     )
 
-    return op.procedural_name(), EmitGemmInstance().emit(
-        op, no_beta_scaling=no_beta_scaling, batched=batched
+    name = op.procedural_name()
+    return name, _KERNEL_EMITTER.emit(op, no_beta_scaling=no_beta_scaling, batched=batched)
+
+
+class GemmCandidate:
+    """A candidate kernel produced by enumerate_gemm_operators.
+
+    Thousands of candidates can be alive at once during enumeration, so this
+    uses __slots__ instead of a per-op dict to cut per-instance overhead.
+    Fields can still be read dict-style for callers that expect the old dicts.
+    """
+
+    __slots__ = (
+        "src",
+        "op_def",
+        "dtype_tags",
+        "ld",
+        "op",
+        "name",
+        "tile_description",
+        "alignment",
+        "data_type",
+        "swizzle_functor",
+        "runtime",
+        "opdef",
+    )
+
+    def __init__(
+        self,
+        src=None,
+        op_def=None,
+        dtype_tags=None,
+        ld=None,
+        op=None,
+        name=None,
+        tile_description=None,
+        alignment=None,
+        data_type=None,
+        swizzle_functor=None,
+        runtime=float("inf"),
+        opdef=None,
+    ):
+        self.src = src
+        self.op_def = op_def
+        self.dtype_tags = dtype_tags
+        self.ld = ld
+        self.op = op
+        self.name = name
+        self.tile_description = tile_description
+        self.alignment = alignment
+        self.data_type = data_type
+        self.swizzle_functor = swizzle_functor
+        self.runtime = runtime
+        self.opdef = opdef
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def replace(self, **updates):
+        """Return a copy of the candidate with the given fields replaced."""
+        kwargs = {slot: getattr(self, slot) for slot in self.__slots__}
+        kwargs.update(updates)
+        return GemmCandidate(**kwargs)
+
+    def to_dict(self):
+        """Return the candidate as a plain dict."""
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+# Rendering a candidate is pure-Python template work; below this many
+# candidates the pool startup costs more than the overlap saves.
+_PARALLEL_RENDER_MIN_CANDIDATES = 32
+
+
+def _render_candidate(args):
+    """Instantiate and render one (tile, alignment) candidate.
+
+    Module level (with a single packed argument) so that it can be dispatched
+    to a multiprocessing pool; returns None when filtered out by name.
+    """
+    (
+        tile_description,
+        alignment,
+        tensor_descriptions,
+        data_type,
+        swizzling_functor,
+        name_filter,
+    ) = args
+    _load_emitters()
+    element_a, element_b, element_c, element_epilogue = data_type
+    A, B, C = tensor_descriptions[alignment]
+
+    op = _GemmOperation(
+        tile_description.minimum_compute_capability,
+        tile_description,
+        A,
+        B,
+        C,
+        element_epilogue,
+        EpilogueFunctor.LinearCombination,
+        swizzling_functor,
+    )
+    name = op.procedural_name()
+
+    if name_filter is not None and name != name_filter:
+        return None
+
+    op_def = _KERNEL_EMITTER.emit(op, batched=False)
+    ld = op.leading_dim()
+    dtype_tags = (DataTypeTag[element_a], DataTypeTag[element_b], DataTypeTag[element_c])
+    src = _PROFILER_EMITTER.emit(name, op_def, *dtype_tags, ld)
+
+    return GemmCandidate(
+        src=src,
+        op_def=op_def,
+        dtype_tags=dtype_tags,
+        ld=ld,
+        op=op,
+        name=name,
+        tile_description=tile_description,
+        alignment=alignment,
+        data_type=data_type,
+        swizzle_functor=swizzling_functor,
     )
 
 
@@ -73,53 +226,59 @@ def enumerate_gemm_operators(
     data_type,
     alignment_constraints,
     swizzling_functor=SwizzlingFunctor.Identity8,
+    name_filter=None,
 ):
-    """Exhaustively instantiate all kernels from a given configuration."""
-    ret = []
-    kernel_emitter = EmitGemmInstance()
-    profiler_emitter = GemmProfilerEmitter()
+    """Exhaustively instantiate all kernels from a given configuration.
 
-    element_a, element_b, element_c, element_epilogue = data_type
+    When name_filter is given, only the kernel with that procedural name is
+    instantiated, skipping the profiler source rendering for everything else.
+    Large enumerations spread the rendering across a process pool.
+    """
+    _load_emitters()
+    element_a, element_b, element_c, _ = data_type
 
-    for tile_description in tile_descriptions:
-        for alignment in alignment_constraints:
-            A = TensorDescription(element_a, LayoutType.RowMajor, alignment)
-            B = TensorDescription(element_b, LayoutType.ColumnMajor, alignment)
-            C = TensorDescription(element_c, LayoutType.RowMajor, alignment)
-
-            op = GemmOperation(
-                tile_description.minimum_compute_capability,
-                tile_description,
-                A,
-                B,
-                C,
-                element_epilogue,
-                EpilogueFunctor.LinearCombination,
-                swizzling_functor,
-            )
+    # The tensor descriptions depend only on the alignment, so build them once
+    # instead of once per (tile, alignment) combination.
+    tensor_descriptions = {
+        alignment: (
+            TensorDescription(element_a, LayoutType.RowMajor, alignment),
+            TensorDescription(element_b, LayoutType.ColumnMajor, alignment),
+            TensorDescription(element_c, LayoutType.RowMajor, alignment),
+        )
+        for alignment in alignment_constraints
+    }
 
-            src = profiler_emitter.emit(
-                op.procedural_name(),
-                kernel_emitter.emit(op, batched=False),
-                DataTypeTag[element_a],
-                DataTypeTag[element_b],
-                DataTypeTag[element_c],
-                op.leading_dim(),
-            )
+    candidate_args = [
+        (tile, alignment, tensor_descriptions, data_type, swizzling_functor, name_filter)
+        for tile, alignment in product(tile_descriptions, alignment_constraints)
+    ]
 
-            ret.append(
-                {
-                    "src": src,
-                    "op": op,
-                    "name": op.procedural_name(),
-                    "tile_description": tile_description,
-                    "alignment": alignment,
-                    "data_type": data_type,
-                    "swizzle_functor": swizzling_functor,
-                }
-            )
+    if name_filter is None and len(candidate_args) >= _PARALLEL_RENDER_MIN_CANDIDATES:
+        with multiprocessing.Pool(multiprocessing.cpu_count()) as pool:
+            rendered = pool.map(_render_candidate, candidate_args)
+    else:
+        rendered = map(_render_candidate, candidate_args)
+
+    return [candidate for candidate in rendered if candidate is not None]
+
+
+# Known good kernels for shapes too small to be worth profiling, picked by
+# profiling representative small GEMM workloads offline. For such shapes the
+# profiling overhead dominates and small-tile kernels win regardless.
+SMALL_SHAPE_KERNELS = {
+    75: {
+        "float16": "cutlass_tensorop_h1688gemm_64x64_32x2_tn_align1",
+        "float32": "cutlass_tensorop_s1688gemm_f16_64x64_32x2_tn_align1",
+    },
+    80: {
+        "float16": "cutlass_tensorop_h1688gemm_64x64_32x2_tn_align1",
+        "float32": "cutlass_tensorop_s1688gemm_f16_64x64_32x2_tn_align1",
+    },
+}
 
-    return ret
+
+def _is_small_shape(M, N, K):
+    return M * N < 8192 and K >= 256
 
 
 # TODO(masahi): A sensible way to pick reasonable default kernels
@@ -144,67 +303,259 @@ class CutlassGemmProfiler:
         self.engine = ProfilerEngine(sm, cutlass_path, binary_path)
         self.sm = sm
         self.cache = {}
+        self._ops_cache = {}
+        self._opdef_cache = {}
+        cache_dir = os.environ.get("TVM_CUTLASS_PROFILE_CACHE_DIR", None)
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._cache_path = os.path.join(cache_dir, "sm%d.json" % sm)
+        else:
+            self._cache_path = None
+        self._disk_cache = self._load_disk_cache()
+
+    def _load_disk_cache(self):
+        """Load previously profiled results, mapping (M, N, K, out_dtype) to a kernel name."""
+        if self._cache_path is None or not os.path.exists(self._cache_path):
+            return {}
+        with open(self._cache_path) as f:
+            entries = json.load(f)
+        return {tuple(entry["key"]): entry for entry in entries}
+
+    def _update_disk_cache(self, key, op):
+        """Record the winning kernel for key on disk, merging with concurrent writers."""
+        if self._cache_path is None:
+            return
+        self._disk_cache[key] = {"key": list(key), "name": op.name, "runtime": op.runtime}
+        import fcntl
+
+        lock_path = self._cache_path + ".lock"
+        with open(lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Merge entries written by other processes since our last load.
+                merged = self._load_disk_cache()
+                merged.update(self._disk_cache)
+                self._disk_cache = merged
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self._cache_path))
+                with os.fdopen(fd, "w") as f:
+                    json.dump(list(self._disk_cache.values()), f)
+                os.rename(tmp_path, self._cache_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _get_ops(self, out_dtype, name_filter=None):
+        """Return all candidate kernels for out_dtype, enumerating them on the first request.
+
+        The returned list is shared across calls, so callers must not mutate its entries.
+        """
+        key = (out_dtype, name_filter)
+        if key not in self._ops_cache:
+            op_creator = enumerate_gemm_operators
+            if name_filter is not None:
+                op_creator = partial(enumerate_gemm_operators, name_filter=name_filter)
+            self._ops_cache[key] = GENERATOR_FUNC_TABLE[self.sm](out_dtype, op_creator=op_creator)
+        return self._ops_cache[key]
 
     def check_align(self, op_name, M, N, K):
-        """Filter out kernels that cannot be supported."""
-        aligns = re.findall(r"align[1|2|4|8]", op_name)
-        assert len(aligns) == 1
+        """Filter out kernels that cannot be supported.
+
+        select_op reads the alignment recorded on the op entry directly; this
+        is kept for callers that only have the kernel name.
+        """
+        match = _ALIGN_RE.search(op_name)
+        assert match is not None
         # The same alignment is used for all axes
-        align = int(aligns[0][-1])
+        align = int(match.group(1))
         # TODO(masahi): CUTLASS alignment check on gemm kernels is too restrictive.
         # See https://github.com/NVIDIA/cutlass/issues/362.
         # When the above issue is resolved, we can remove the alignment check on M below.
-        return all([dim % align == 0 for dim in [M, N, K]])
+        return M % align == 0 and N % align == 0 and K % align == 0
 
     def get_default(self, op_type, out_dtype, batched=False):
         """Return the default kernel for the requested architecture.
         For now, the default kernel was picked arbitrary.
         """
-        ops = GENERATOR_FUNC_TABLE[self.sm](out_dtype, op_creator=enumerate_gemm_operators)
         default_kernel_name = DEFAULT_KERNELS[self.sm][out_dtype]
-        filtered = list(filter(lambda op: op["name"] == default_kernel_name, ops))
-        assert len(filtered) == 1
-        op = filtered[0]
+        ops = self._get_ops(out_dtype, name_filter=default_kernel_name)
+        assert len(ops) == 1
+        op = ops[0]
         name, opdef = create_gemm_operator_with_epilogue(
             op_type,
-            op["tile_description"],
-            op["data_type"],
-            op["alignment"],
-            op["swizzle_functor"],
+            op.tile_description,
+            op.data_type,
+            op.alignment,
+            op.swizzle_functor,
             batched=batched,
         )
-        op.update({"name": name, "opdef": opdef})
-        return op
+        return op.replace(name=name, opdef=opdef)
+
+    def _lookup_small_shape_kernel(self, out_dtype):
+        """Return the precomputed kernel for small shapes, or None if none is known."""
+        kernel_name = SMALL_SHAPE_KERNELS[self.sm].get(out_dtype, None)
+        if kernel_name is None:
+            return None
+        ops = self._get_ops(out_dtype, name_filter=kernel_name)
+        if len(ops) != 1:
+            return None
+        # runtime == -1 marks the kernel as picked heuristically, not measured.
+        return ops[0].replace(runtime=-1)
+
+    def _evaluate_ops(self, ops, M, N, K, runtimes, rotating_buffer_bytes):
+        """Compile and time the given candidate kernels, accumulating results into runtimes.
 
-    def select_op(self, M, N, K, out_dtype, profile_all=True, use_multiprocessing=False):
+        The profiler binaries wall-clock-time their kernels on the device, so
+        the runs are strictly serialized: concurrent runs would contend for the
+        GPU and inflate each other's measurements.
+        """
+        if not ops:
+            return
+        # Bundle the whole batch into one translation unit so the nvcc frontend
+        # startup cost is paid once per batch rather than once per kernel.
+        digest = hashlib.sha256("\n".join(sorted(op.name for op in ops)).encode("utf-8"))
+        batch_name = "cutlass_gemm_batch_%s" % digest.hexdigest()[:16]
+        _load_emitters()
+        dtype_a, dtype_b, dtype_c = ops[0].dtype_tags
+        batch_src = _PROFILER_EMITTER.emit_batch(
+            [(op.name, op.op_def) for op in ops], dtype_a, dtype_b, dtype_c, ops[0].ld
+        )
+        self.engine.compile_batch(batch_src, batch_name)
+        evaluate = partial(
+            self.engine.evaluate,
+            args=[M, N, K],
+            rotating_buffer_bytes=rotating_buffer_bytes,
+            binary=batch_name,
+        )
+        for op in ops:
+            runtimes[op.name] = evaluate(op)
+
+    def select_op(
+        self,
+        M,
+        N,
+        K,
+        out_dtype,
+        profile_all=True,
+        use_multiprocessing=False,
+        prescreen_top_k=6,
+        rotating_buffer_bytes=256 * 1024 * 1024,
+        use_heuristic=False,
+    ):
         """
         Profile and select the best kernel from candidate kernels.
         See the documentation for the profile method below.
+
+        When profile_all is True, candidates are narrowed in two stages: all tile
+        descriptions are first timed at a single alignment, and only the top
+        prescreen_top_k tiles have their remaining alignment variants profiled.
+
+        When use_heuristic is True, shapes too small to benefit from profiling
+        are dispatched to a precomputed small-tile kernel without compiling or
+        running any profiler.
         """
-        if (M, N, K) in self.cache:
-            op = self.cache[(M, N, K)]
+        # The profiled runtime depends on the output dtype as well as the shape,
+        # so both cache keys carry it; op_type and batched only affect the
+        # epilogue emitted later, not which kernel wins.
+        key = (M, N, K, out_dtype)
+        if key in self.cache:
+            op = self.cache[key]
             return op
 
-        ops = GENERATOR_FUNC_TABLE[self.sm](
-            out_dtype,
-            op_creator=enumerate_gemm_operators,
-        )
-        ops = list(filter(lambda op: self.check_align(op["name"], M, N, K), ops))
-
-        if profile_all:
-            self.engine.compile_all(ops, use_multiprocessing)
+        if use_heuristic and _is_small_shape(M, N, K):
+            op = self._lookup_small_shape_kernel(out_dtype)
+            if op is not None:
+                self.cache[key] = op
+                return op
 
-        for op in ops:
-            out = self.engine.evaluate(op, [M, N, K])
-            op["runtime"] = out
-            if out < float("inf") and not profile_all:
-                self.cache[(M, N, K)] = op
+        disk_entry = self._disk_cache.get(key, None)
+        if disk_entry is not None:
+            matched = [op for op in self._get_ops(out_dtype) if op.name == disk_entry["name"]]
+            if len(matched) == 1:
+                op = matched[0].replace(runtime=disk_entry["runtime"])
+                self.cache[key] = op
                 return op
 
-        op = min(ops, key=lambda i: i["runtime"])
-        self.cache[(M, N, K)] = op
+        ops = self._get_ops(out_dtype)
+        # The same alignment is used for all axes. Filter on the alignment
+        # recorded at enumeration time rather than re-parsing it from the name.
+        # TODO(masahi): CUTLASS alignment check on gemm kernels is too restrictive.
+        # See https://github.com/NVIDIA/cutlass/issues/362.
+        # When the above issue is resolved, we can remove the alignment check on M below.
+        ops = [
+            op
+            for op in ops
+            if M % op.alignment == 0 and N % op.alignment == 0 and K % op.alignment == 0
+        ]
+
+        # The op entries are shared across shapes via _get_ops, so the measured
+        # runtimes are kept in a side table instead of being written into them.
+        runtimes = {}
+        if profile_all:
+            # Group the alignment variants of each tile description, profile one
+            # variant per tile, then sweep the remaining alignments only for the
+            # top prescreen_top_k tiles. The grouping key is by value, not
+            # identity, since candidates rendered in a worker process carry
+            # unpickled copies of the shared tile descriptions.
+            groups = {}
+            for op in ops:
+                tile = op.tile_description
+                tile_key = (tile.procedural_name(), tuple(tile.math_instruction.instruction_shape))
+                groups.setdefault(tile_key, []).append(op)
+            groups = list(groups.values())
+            phase1 = [max(group, key=lambda op: op.alignment) for group in groups]
+            self._evaluate_ops(phase1, M, N, K, runtimes, rotating_buffer_bytes)
+            ranked = sorted(zip(phase1, groups), key=lambda pair: runtimes[pair[0].name])
+            phase2 = [
+                op
+                for _, group in ranked[:prescreen_top_k]
+                for op in group
+                if op.name not in runtimes
+            ]
+            self._evaluate_ops(phase2, M, N, K, runtimes, rotating_buffer_bytes)
+            ops = [op for op in ops if op.name in runtimes]
+        else:
+            for op in ops:
+                out = self.engine.evaluate(op, [M, N, K], rotating_buffer_bytes)
+                runtimes[op.name] = out
+                # An inf runtime means the kernel failed to compile or run, so
+                # stop at the first one that actually works. The pick is the
+                # first working kernel rather than the winner, so it is not
+                # persisted to disk where a later profile_all run would take it
+                # for a fully profiled result.
+                if out < float("inf"):
+                    op = op.replace(runtime=out)
+                    self.cache[key] = op
+                    return op
+
+        valid_ops = [op for op in ops if runtimes[op.name] < float("inf")]
+        assert valid_ops, "No valid CUTLASS kernel found for shape (%d, %d, %d)" % (M, N, K)
+        op = min(valid_ops, key=lambda i: runtimes[i.name])
+        op = op.replace(runtime=runtimes[op.name])
+        self.cache[key] = op
+        self._update_disk_cache(key, op)
         return op
 
+    def profile_shape(
+        self, M, N, K, out_dtype, profile_all=True, use_multiprocessing=False, use_heuristic=False
+    ):
+        """Profile a shape once and return the winning op, shared by all epilogues.
+
+        The candidates are timed with the plain LinearCombination epilogue and
+        the result is assumed to preserve the relative ranking of kernels under
+        the fused epilogue variants, which shift absolute runtimes but rarely
+        the winner. The cache key therefore deliberately excludes op_type, so
+        every epilogue variant of the same (M, N, K, out_dtype) reuses one
+        profiling run.
+        """
+        return self.select_op(
+            M,
+            N,
+            K,
+            out_dtype,
+            profile_all=profile_all,
+            use_multiprocessing=use_multiprocessing,
+            use_heuristic=use_heuristic,
+        )
+
     def profile(
         self,
         op_type,
@@ -215,22 +566,53 @@ class CutlassGemmProfiler:
         profile_all=True,
         use_multiprocessing=False,
         batched=False,
+        use_heuristic=False,
+        swizzling_functor=None,
     ):
         """Profile and select the best kernel from candidate kernels.
         If profile_all is False, return immediately after the first applicable kernel is found.
-        If use_multiprocessing is True, compile all profiler executables in parallel.
+        use_multiprocessing only parallelizes compilation; since the candidates
+        are batched into a single nvcc invocation it has no effect here, and the
+        profiler runs themselves are always serialized so that the measured
+        runtimes are not distorted by concurrent kernels on the device.
+        If use_heuristic is True, small shapes skip profiling entirely and use a
+        precomputed kernel.
+
+        The threadblock swizzle is a compile time template parameter in the
+        CUTLASS kernels this generator targets, and the procedural kernel names
+        do not encode it, so swizzle variants cannot be profiled apart. Instead
+        candidates are profiled once with the default swizzle and any variant
+        of the winner is emitted from that shared result: pass
+        swizzling_functor to override the swizzle in the emitted kernel without
+        re-profiling or compiling another profiler binary (batched=True keeps
+        forcing the batched swizzle).
         """
-        op = self.select_op(
-            M, N, K, out_dtype, profile_all=profile_all, use_multiprocessing=use_multiprocessing
+        op = self.profile_shape(
+            M,
+            N,
+            K,
+            out_dtype,
+            profile_all=profile_all,
+            use_multiprocessing=use_multiprocessing,
+            use_heuristic=use_heuristic,
         )
+        if swizzling_functor is None:
+            swizzling_functor = op.swizzle_functor
 
-        name, opdef = create_gemm_operator_with_epilogue(
-            op_type,
-            op["tile_description"],
-            op["data_type"],
-            op["alignment"],
-            op["swizzle_functor"],
-            batched=batched,
-        )
+        # Emitting the kernel with the requested epilogue only depends on the
+        # winning op, the op_type, the swizzle and the batched flag, so reuse
+        # the rendered definition when the same GEMM recurs with a different
+        # shape.
+        opdef_key = (op.name, op_type, batched, swizzling_functor)
+        if opdef_key not in self._opdef_cache:
+            self._opdef_cache[opdef_key] = create_gemm_operator_with_epilogue(
+                op_type,
+                op.tile_description,
+                op.data_type,
+                op.alignment,
+                swizzling_functor,
+                batched=batched,
+            )
+        name, opdef = self._opdef_cache[opdef_key]
 
-        return name, opdef, op["runtime"]
+        return name, opdef, op.runtime
@@ -221,15 +221,38 @@ class ProfilerEngine:
             for op in ops:
                 self._compile(op)
 
-    def evaluate(self, op, args):
-        """Run the profiler executable corresponding to op_name with args."""
+    def compile_batch(self, src, batch_name):
+        """Compile one translation unit bundling many profiler kernels.
+
+        This invokes nvcc once for the whole batch; the resulting binary
+        dispatches on a kernel name passed as its first argument.
+        """
+        self._compile({"name": batch_name, "src": src})
+
+    def evaluate(self, op, args, rotating_buffer_bytes=None, binary=None):
+        """Run the profiler executable corresponding to op_name with args.
+
+        When rotating_buffer_bytes is given, it is forwarded to the profiler
+        binary, which rotates its input tensors across a pool of that size to
+        keep repeated runs from timing L2-resident inputs.
+
+        When binary is given, it names a batch executable produced by
+        compile_batch, and the op is selected inside it by name; if the batch
+        binary is missing (e.g. its compilation failed), fall back to
+        compiling the op standalone.
+        """
         op_name = op["name"]
-        opath = os.path.join(self.binary_prefix, op_name)
-        if not os.path.exists(opath):
-            self._compile(op)
-        cmd = [opath]
+        if binary is not None and os.path.exists(os.path.join(self.binary_prefix, binary)):
+            cmd = [os.path.join(self.binary_prefix, binary), op_name]
+        else:
+            opath = os.path.join(self.binary_prefix, op_name)
+            if not os.path.exists(opath):
+                self._compile(op)
+            cmd = [opath]
         for arg in args:
             cmd.append(str(arg))
+        if rotating_buffer_bytes is not None:
+            cmd.append(str(rotating_buffer_bytes))
         try:
             sp = subprocess.run(cmd, capture_output=True, check=True)
             rt = float(sp.stdout)
@@ -537,5 +537,35 @@ def test_conv2d_residual_block():
         verify_conv2d(func, func, d_shape, w_shape, sm=80, atol=tol, rtol=tol, run_benchmark=False)
 
 
+def test_gemm_candidate():
+    from tvm.contrib.cutlass.gen_gemm import GemmCandidate
+
+    cand = GemmCandidate(name="some_kernel", alignment=8)
+    # Callers that expect the old dict entries read fields dict-style.
+    assert cand["name"] == "some_kernel"
+    assert cand["alignment"] == 8
+    replaced = cand.replace(runtime=1.0)
+    assert replaced.runtime == 1.0
+    assert replaced.name == "some_kernel"
+    # The original is shared across shapes and must not change.
+    assert cand.runtime == float("inf")
+
+
+def test_gemm_profiler_small_shape_heuristic():
+    # The heuristic path compiles and runs nothing, so it works without CUDA.
+    from tvm.contrib.cutlass.gen_gemm import CutlassGemmProfiler
+
+    profiler = CutlassGemmProfiler(80, "", "")
+    op = profiler._lookup_small_shape_kernel("float16")
+    assert op is not None
+    assert op.runtime == -1
+
+    selected = profiler.select_op(64, 64, 1024, "float16", use_heuristic=True)
+    assert selected.name == op.name
+    assert selected.runtime == -1
+    # The heuristic pick is cached like a profiled one.
+    assert profiler.select_op(64, 64, 1024, "float16", use_heuristic=True) is selected
+
+
 if __name__ == "__main__":
     pytest.main([__file__])